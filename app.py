@@ -4,21 +4,94 @@ Class-based architecture for clean, maintainable code
 """
 
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import APITimeoutError, AsyncOpenAI
+import asyncio
+import hashlib
+import httpx
 import json
+import mmap
 import os
-import requests
-from pypdf import PdfReader
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from functools import cached_property
+from itertools import islice
 import gradio as gr
 
+# PyMuPDF is much faster than pypdf; fall back to pypdf if it isn't installed
+try:
+    import pymupdf
+    PDF_EXTRACTOR = "pymupdf"
+except ImportError:
+    from pypdf import PdfReader
+    PDF_EXTRACTOR = "pypdf"
+
+# orjson is a faster drop-in for tool (de)serialization; fall back to json
+try:
+    import orjson
+    
+    json_loads = orjson.loads
+    
+    def json_dumps(obj):
+        return orjson.dumps(obj).decode()
+except ImportError:
+    json_loads = json.loads
+    json_dumps = json.dumps
+
+# tiktoken encoding, loaded on first use (it may need a download); False if unavailable
+_encoding = None
+
+
+def count_tokens(text):
+    """Count tokens with tiktoken, or estimate ~4 characters per token without it"""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.encoding_for_model("gpt-4o-mini")
+        except Exception as e:
+            print(f"⚠️ tiktoken unavailable, estimating token counts: {e}")
+            _encoding = False
+    
+    if _encoding:
+        return len(_encoding.encode(text))
+    return len(text) // 4 + 1
+
+# Upper bound on prompt tokens sent per request (system prompt + history + message)
+MAX_PROMPT_TOKENS = 16000
+# Approximate per-message framing overhead in the chat format
+TOKENS_PER_MESSAGE = 4
+
+# Per-attempt OpenAI timeouts and retries. These make a stalled connection,
+# upload or read fail fast so the retry gets a chance; they don't add up to a
+# hard bound, since each applies per operation (read resets on every byte).
+OPENAI_TIMEOUT = httpx.Timeout(connect=5.0, read=10.0, write=10.0, pool=5.0)
+OPENAI_MAX_RETRIES = 1
+# The only hard bound: seconds for one model call, including retries and the
+# whole stream. It resets on every agentic iteration, so a single chat turn
+# can take up to max_iterations * RESPONSE_TIMEOUT (450s) in the worst case.
+RESPONSE_TIMEOUT = 45
+TIMEOUT_REPLY = (
+    "Sorry, I'm having trouble responding right now. "
+    "I've noted your question so I can follow up - please try again in a moment."
+)
+
 # Load environment variables
 load_dotenv(override=True)
 
+# Shared client so notifications reuse a keep-alive connection instead of
+# paying a new TCP+TLS handshake every time
+pushover_client = httpx.AsyncClient(
+    limits=httpx.Limits(max_connections=8, max_keepalive_connections=4),
+    timeout=5.0
+)
+
 
-def push(text):
+async def push(text):
     """Send push notification via Pushover"""
     try:
-        response = requests.post(
+        response = await pushover_client.post(
             "https://api.pushover.net/1/messages.json",
             data={
                 "token": os.getenv("PUSHOVER_TOKEN"),
@@ -32,18 +105,120 @@ def push(text):
         print(f"⚠️ Notification failed: {e}")
 
 
-def record_user_details(email, name="Name not provided", notes="not provided"):
+async def iter_until(aiterable, deadline):
+    """Iterate an async iterable, raising asyncio.TimeoutError once the loop time passes deadline"""
+    loop = asyncio.get_running_loop()
+    iterator = aiterable.__aiter__()
+    while True:
+        try:
+            item = await asyncio.wait_for(iterator.__anext__(), timeout=deadline - loop.time())
+        except StopAsyncIteration:
+            return
+        yield item
+
+
+# Strong references to in-flight notifications so they aren't garbage collected
+background_tasks = set()
+
+
+def notify(text):
+    """Send a push notification in the background without waiting for it"""
+    task = asyncio.create_task(push(text))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
+async def record_user_details(email, name="Name not provided", notes="not provided"):
     """Record user contact information"""
-    push(f"Recording {name} with email {email} and notes {notes}")
+    notify(f"Recording {name} with email {email} and notes {notes}")
     return {"recorded": "ok"}
 
 
-def record_unknown_question(question):
+# Recently recorded questions (hash -> time), oldest first, to suppress duplicates
+recent_questions = OrderedDict()
+RECENT_QUESTIONS_MAX = 256
+RECENT_QUESTIONS_WINDOW = 600  # seconds
+
+
+def is_recent_question(question):
+    """Check whether a question was already recorded within the window, and remember it"""
+    key = hashlib.blake2b(question.strip().lower().encode("utf-8"), digest_size=16).digest()
+    now = time.monotonic()
+    
+    seen = recent_questions.get(key)
+    if seen is not None and now - seen < RECENT_QUESTIONS_WINDOW:
+        return True
+    
+    recent_questions[key] = now
+    recent_questions.move_to_end(key)
+    while len(recent_questions) > RECENT_QUESTIONS_MAX:
+        recent_questions.popitem(last=False)
+    return False
+
+
+async def record_unknown_question(question):
     """Record questions that couldn't be answered"""
-    push(f"Recording question: {question}")
+    if is_recent_question(question):
+        print(f"↩️ Skipping duplicate question: {question}")
+    else:
+        notify(f"Recording question: {question}")
     return {"recorded": "ok"}
 
 
+def extract_pdf_text(path):
+    """Extract the text of every page in a PDF"""
+    if PDF_EXTRACTOR == "pymupdf":
+        with pymupdf.open(path) as doc:
+            return "\n".join(page.get_text("text") for page in doc)
+    
+    reader = PdfReader(path)
+    parts = []
+    for page in reader.pages:
+        text = page.extract_text()
+        if text:
+            parts.append(text)
+    return "".join(parts)
+
+
+def load_pdf_text(path, cache_dir="me/.cache"):
+    """
+    Load a PDF's text, reusing a cached extraction when the file is unchanged.
+    
+    The cache is keyed by a hash of the PDF bytes and the extractor in use,
+    so replacing the PDF invalidates it automatically.
+    """
+    with open(path, "rb") as f:
+        digest = hashlib.blake2b(f.read()).hexdigest()
+    
+    stem = os.path.splitext(os.path.basename(path))[0]
+    cache_path = os.path.join(cache_dir, f"{stem}-{PDF_EXTRACTOR}-{digest}.txt")
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+    
+    text = extract_pdf_text(path)
+    
+    # Write atomically through a temp file unique to this writer, so a crash or
+    # a concurrent writer (another thread or worker) never leaves a torn entry
+    tmp_path = None
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            "w", encoding="utf-8", dir=cache_dir, suffix=".tmp", delete=False
+        ) as f:
+            tmp_path = f.name
+            f.write(text)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"⚠️ Could not cache PDF text: {e}")
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    
+    return text
+
+
 # Tool schemas
 record_user_details_json = {
     "name": "record_user_details",
@@ -85,11 +260,32 @@ record_unknown_question_json = {
     }
 }
 
+# Built once at import and shared by every request. Keep it a plain list of
+# dicts: the SDK JSON-encodes the whole request body anyway, and read-only
+# wrappers like MappingProxyType aren't JSON serializable.
 tools = [
     {"type": "function", "function": record_user_details_json},
     {"type": "function", "function": record_unknown_question_json}
 ]
 
+# Tool name -> implementation, used to dispatch the model's tool calls
+TOOL_REGISTRY = {
+    "record_user_details": record_user_details,
+    "record_unknown_question": record_unknown_question,
+}
+
+
+# System prompt; filled in once per agent by Me._build_system_prompt
+SYSTEM_PROMPT_TEMPLATE = "You are acting as {name}. You are answering questions on {name}'s website, \
+particularly questions related to {name}'s career, background, skills and experience. \
+Your responsibility is to represent {name} for interactions on the website as faithfully as possible. \
+You are given a summary of {name}'s background and LinkedIn profile which you can use to answer questions. \
+Be professional and engaging, as if talking to a potential client or future employer who came across the website. \
+If you don't know the answer to any question, use your record_unknown_question tool to record the question that you couldn't answer, even if it's about something trivial or unrelated to career. \
+If the user is engaging in discussion, try to steer them towards getting in touch via email; ask for their email and record it using your record_user_details tool.\
+\n\n## Summary:\n{summary}\n\n## LinkedIn Profile:\n{linkedin}\n\n\
+With this context, please chat with the user, always staying in character as {name}."
+
 
 class Me:
     """
@@ -104,107 +300,205 @@ class Me:
     
     def __init__(self):
         """Initialize the agent with personal data"""
-        self.openai = OpenAI()
+        # Shared connection pool so concurrent chats reuse keep-alive connections
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=50)
+        )
+        self.openai = AsyncOpenAI(
+            http_client=self.http_client,
+            timeout=OPENAI_TIMEOUT,
+            max_retries=OPENAI_MAX_RETRIES
+        )
+        
+        # Request options shared by every completion call; include_usage reports
+        # how many prompt tokens were served from OpenAI's prompt cache
+        self._create_kwargs = {
+            "model": "gpt-4o-mini",
+            "tools": tools,
+            "stream": True,
+            "stream_options": {"include_usage": True}
+        }
+        
         self.name = "Your Name"  # ← CHANGE THIS TO YOUR NAME!
         
-        # Load LinkedIn profile
+        # cached_property has no lock on Python 3.12+, so serialize the first load
+        self._load_lock = threading.Lock()
+        
+        # LinkedIn, summary and system prompt load lazily on first use
+        print(f"✓ Agent initialized for: {self.name}")
+    
+    @cached_property
+    def linkedin(self):
+        """LinkedIn profile text, loaded on first access"""
         try:
-            reader = PdfReader("me/linkedin.pdf")
-            self.linkedin = ""
-            for page in reader.pages:
-                text = page.extract_text()
-                if text:
-                    self.linkedin += text
-            print(f"✓ LinkedIn loaded ({len(self.linkedin)} chars)")
+            linkedin = load_pdf_text("me/linkedin.pdf")
+            print(f"✓ LinkedIn loaded ({len(linkedin)} chars)")
         except FileNotFoundError:
-            self.linkedin = "No LinkedIn data available."
+            linkedin = "No LinkedIn data available."
             print("⚠️ linkedin.pdf not found in 'me' folder")
-        
-        # Load personal summary
+        return linkedin
+    
+    @cached_property
+    def summary(self):
+        """Personal summary, read through a read-only mmap and decoded on first access"""
         try:
-            with open("me/summary.txt", "r", encoding="utf-8") as f:
-                self.summary = f.read()
-            print(f"✓ Summary loaded ({len(self.summary)} chars)")
+            with open("me/summary.txt", "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    summary = ""
+                else:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        summary = mm[:].decode("utf-8")
+                # Normalize newlines the way text-mode reads do
+                summary = summary.replace("\r\n", "\n").replace("\r", "\n")
+            print(f"✓ Summary loaded ({len(summary)} chars)")
         except FileNotFoundError:
-            self.summary = "No summary available."
+            summary = "No summary available."
             print("⚠️ summary.txt not found in 'me' folder")
+        return summary
+    
+    def load_profile(self):
+        """
+        Load the profile data and build the system prompt if not done yet.
         
-        print(f"✓ Agent initialized for: {self.name}")
+        This does blocking file I/O, PDF extraction and tokenizing, so chat()
+        runs it off the event loop on the first turn.
+        """
+        with self._load_lock:
+            return self._prefix_tokens
     
-    def handle_tool_call(self, tool_calls):
+    @cached_property
+    def _system_prompt(self):
         """
-        Execute tool calls from the AI model.
+        System prompt, built once on first use; it doesn't change between turns.
         
-        Uses dynamic dispatch via globals() to avoid hardcoded if/else statements.
+        Keeping it byte-identical and first lets OpenAI's automatic prompt
+        caching reuse the long profile prefix, so never put per-turn data in it.
+        """
+        return self._build_system_prompt()
+    
+    @cached_property
+    def _prefix(self):
+        """Frozen leading messages shared by every conversation"""
+        return ({"role": "system", "content": self._system_prompt},)
+    
+    @cached_property
+    def _prefix_tokens(self):
+        """Token count of the frozen prefix"""
+        return count_tokens(self._system_prompt) + TOKENS_PER_MESSAGE
+    
+    def history_start(self, history, message):
+        """
+        Find where the most recent history that fits within MAX_PROMPT_TOKENS begins.
         
         Args:
-            tool_calls: List of tool calls from OpenAI response
+            history: Conversation history from Gradio
+            message: User's new message, which is always kept
         
         Returns:
-            List of tool results in OpenAI format
+            Index of the oldest history message to keep
         """
-        results = []
-        for tool_call in tool_calls:
-            tool_name = tool_call.function.name
-            arguments = json.loads(tool_call.function.arguments)
-            
-            print(f"🔧 Tool called: {tool_name}", flush=True)
-            
-            # Dynamic tool execution
-            tool = globals().get(tool_name)
-            result = tool(**arguments) if tool else {"error": f"Tool {tool_name} not found"}
-            
-            results.append({
-                "role": "tool",
-                "content": json.dumps(result),
-                "tool_call_id": tool_call.id
-            })
+        budget = MAX_PROMPT_TOKENS - self._prefix_tokens - count_tokens(message) - TOKENS_PER_MESSAGE
+        
+        start = len(history)
+        while start > 0:
+            content = history[start - 1].get("content")
+            cost = count_tokens(content if isinstance(content, str) else str(content)) + TOKENS_PER_MESSAGE
+            if cost > budget:
+                break
+            budget -= cost
+            start -= 1
         
-        return results
+        if start:
+            print(f"✂️ Trimmed {start} old messages from history", flush=True)
+        return start
     
-    def system_prompt(self):
+    async def run_tool(self, tool_call):
         """
-        Generate the system prompt with personal context.
+        Execute a single tool call.
+        
+        Uses dispatch via TOOL_REGISTRY to avoid hardcoded if/else statements.
+        
+        Args:
+            tool_call: Tool call accumulated from the streamed OpenAI response
         
         Returns:
-            Complete system prompt string
+            Tool result in OpenAI format
         """
-        prompt = f"You are acting as {self.name}. You are answering questions on {self.name}'s website, \
-particularly questions related to {self.name}'s career, background, skills and experience. \
-Your responsibility is to represent {self.name} for interactions on the website as faithfully as possible. \
-You are given a summary of {self.name}'s background and LinkedIn profile which you can use to answer questions. \
-Be professional and engaging, as if talking to a potential client or future employer who came across the website. \
-If you don't know the answer to any question, use your record_unknown_question tool to record the question that you couldn't answer, even if it's about something trivial or unrelated to career. \
-If the user is engaging in discussion, try to steer them towards getting in touch via email; ask for their email and record it using your record_user_details tool."
+        tool_name = tool_call["function"]["name"]
+        arguments = json_loads(tool_call["function"]["arguments"])
+        
+        print(f"🔧 Tool called: {tool_name}", flush=True)
+        
+        # Dynamic tool execution
+        tool = TOOL_REGISTRY.get(tool_name)
+        result = await tool(**arguments) if tool else {"error": f"Tool {tool_name} not found"}
+        
+        return {
+            "role": "tool",
+            "content": json_dumps(result),
+            "tool_call_id": tool_call["id"]
+        }
+    
+    async def handle_tool_call(self, tool_calls):
+        """
+        Execute tool calls from the AI model.
+        
+        Independent tool calls run concurrently, so a turn takes as long as
+        its slowest tool rather than the sum of all of them. Side-effect-only
+        tools (the record_* tools) return an optimistic result immediately and
+        send their notification in the background, keeping tool latency off
+        the critical path to the next model call.
+        
+        Args:
+            tool_calls: List of tool calls accumulated from the streamed OpenAI response
         
-        prompt += f"\n\n## Summary:\n{self.summary}\n\n## LinkedIn Profile:\n{self.linkedin}\n\n"
-        prompt += f"With this context, please chat with the user, always staying in character as {self.name}."
+        Returns:
+            List of tool results in OpenAI format, in the same order as tool_calls
+        """
+        return list(await asyncio.gather(
+            *(self.run_tool(tool_call) for tool_call in tool_calls)
+        ))
+    
+    def _build_system_prompt(self):
+        """
+        Generate the system prompt with personal context.
         
-        return prompt
+        Returns:
+            Complete system prompt string
+        """
+        return SYSTEM_PROMPT_TEMPLATE.format_map({
+            "name": self.name,
+            "summary": self.summary,
+            "linkedin": self.linkedin
+        })
     
-    def chat(self, message, history):
+    async def chat(self, message, history):
         """
         Main chat function with agentic tool-calling loop.
         
         Process:
-        1. Add user message to conversation
+        1. Add user message to conversation, trimming old history to fit the token budget
         2. Call AI model with tools
         3. If AI wants to use tools, execute them
         4. Send tool results back to AI
-        5. Repeat until AI generates final response
+        5. Repeat until AI generates final response, streamed to the UI
         
         Args:
             message: User's message
             history: Conversation history from Gradio
         
-        Returns:
-            AI's final response
+        Yields:
+            The AI's response so far, growing as tokens stream in
         """
-        messages = [
-            {"role": "system", "content": self.system_prompt()}
-        ] + history + [
-            {"role": "user", "content": message}
-        ]
+        # First turn: load the profile in a worker thread so other sessions
+        # on the event loop aren't stalled by PDF extraction
+        if "_prefix_tokens" not in self.__dict__:
+            await asyncio.get_running_loop().run_in_executor(None, self.load_profile)
+        
+        # Build messages in place rather than concatenating copies of history
+        messages = list(self._prefix)
+        messages.extend(islice(history, self.history_start(history, message), None))
+        messages.append({"role": "user", "content": message})
         
         done = False
         iteration = 0
@@ -213,33 +507,87 @@ If the user is engaging in discussion, try to steer them towards getting in touc
         while not done and iteration < max_iterations:
             iteration += 1
             
-            # Call OpenAI with tools
-            response = self.openai.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=messages,
-                tools=tools
-            )
+            partial = ""
+            tool_calls = []
+            finish_reason = None
             
-            finish_reason = response.choices[0].finish_reason
+            # One deadline covers the request, its retries and the whole stream
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + RESPONSE_TIMEOUT
+            stream = None
             
-            # Check if AI wants to call tools
-            if finish_reason == "tool_calls":
-                message_with_tools = response.choices[0].message
-                tool_calls = message_with_tools.tool_calls
+            try:
+                # Call OpenAI with tools, streaming tokens as they are generated
+                stream = await asyncio.wait_for(
+                    self.openai.chat.completions.create(
+                        messages=messages, **self._create_kwargs
+                    ),
+                    timeout=deadline - loop.time()
+                )
                 
+                async for chunk in iter_until(stream, deadline):
+                    # Usage is informational only; never let a missing field break the turn
+                    usage = getattr(chunk, "usage", None)
+                    details = getattr(usage, "prompt_tokens_details", None)
+                    if details is not None:
+                        cached = getattr(details, "cached_tokens", None) or 0
+                        print(f"💾 Prompt cache: {cached}/{usage.prompt_tokens} tokens", flush=True)
+                    if not chunk.choices:
+                        continue
+                    choice = chunk.choices[0]
+                    delta = choice.delta
+                    
+                    if delta.content:
+                        partial += delta.content
+                        yield partial
+                    
+                    # Tool calls arrive in fragments keyed by index
+                    for tool_call_delta in delta.tool_calls or []:
+                        while len(tool_calls) <= tool_call_delta.index:
+                            tool_calls.append({
+                                "id": "",
+                                "type": "function",
+                                "function": {"name": "", "arguments": ""}
+                            })
+                        tool_call = tool_calls[tool_call_delta.index]
+                        if tool_call_delta.id:
+                            tool_call["id"] = tool_call_delta.id
+                        function_delta = tool_call_delta.function
+                        if function_delta:
+                            if function_delta.name:
+                                tool_call["function"]["name"] += function_delta.name
+                            if function_delta.arguments:
+                                tool_call["function"]["arguments"] += function_delta.arguments
+                    
+                    if choice.finish_reason:
+                        finish_reason = choice.finish_reason
+                
+            except (asyncio.TimeoutError, APITimeoutError, httpx.TimeoutException):
+                # Don't leave the user hanging; log the question so it can be followed up
+                print("⚠️ OpenAI request timed out", flush=True)
+                if stream is not None:
+                    await stream.close()
+                await record_unknown_question(message)
+                yield TIMEOUT_REPLY
+                return
+            
+            # Check if AI wants to call tools (and actually sent some)
+            if finish_reason == "tool_calls" and tool_calls:
                 # Execute tools
-                results = self.handle_tool_call(tool_calls)
+                results = await self.handle_tool_call(tool_calls)
                 
                 # Add to conversation
-                messages.append(message_with_tools)
+                messages.append({
+                    "role": "assistant",
+                    "content": partial or None,
+                    "tool_calls": tool_calls
+                })
                 messages.extend(results)
             else:
                 done = True
         
-        if iteration >= max_iterations:
+        if not done:
             print("⚠️ Max iterations reached")
-        
-        return response.choices[0].message.content
 
 
 if __name__ == "__main__":